@@ -13,3 +13,14 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 BASE_DIR = Path(__file__).resolve().parent
 DOWNLOADS_DIR = BASE_DIR / "downloads"
 DOWNLOADS_DIR.mkdir(exist_ok=True)
+
+# Ограничение нагрузки (middlewares.py)
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "1"))  # пополнение корзины токенов пользователя
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "15"))  # ёмкость корзины (альбом до 10 фото + команды)
+HEAVY_MAX_CONCURRENCY = int(os.getenv("HEAVY_MAX_CONCURRENCY", "4"))  # одновременных скачиваний/публикаций
+HEAVY_MAX_QUEUE_PER_USER = int(os.getenv("HEAVY_MAX_QUEUE_PER_USER", "10"))  # ожидающих задач одного пользователя
+HEAVY_MAX_QUEUE_TOTAL = int(os.getenv("HEAVY_MAX_QUEUE_TOTAL", "100"))  # ожидающих задач всего
+
+# Прогрев после запуска (main.py): клиент VK и сессии для недавно активных пользователей
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") not in ("0", "false", "no")
+PREWARM_RECENT_USERS = int(os.getenv("PREWARM_RECENT_USERS", "20"))
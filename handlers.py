@@ -1,20 +1,30 @@
 """Обработчики Telegram-бота: приём медиа, текста и уточнений по аудио/музыке."""
+import asyncio
+import importlib
 import logging
+import sys
+import time
 from pathlib import Path
 
 from aiogram import Bot, F, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.exceptions import TelegramAPIError
 from aiogram.types import CallbackQuery, Message
 
 from config import DOWNLOADS_DIR
 from models import PublishRequest
-from storage import get_user_credentials, init_db, set_user_credentials
-from vk_client import VKPublisher, validate_vk_token
+from progress import DEBOUNCE_INTERVAL, ReplyCoalescer, StatusMessage
+from storage import get_user_credentials, init_db, mark_user_active, set_user_credentials
+
+# vk_client (vk_api, requests) импортируется лениво — при первом использовании или прогреве в main.py
 
 logger = logging.getLogger(__name__)
 router = Router()
+# Один статус на серию фото вместо отдельного ответа на каждое фото (flood limits Telegram)
+reply_coalescer = ReplyCoalescer()
+_first_publish_reported = False
 
 
 class PublishStates(StatesGroup):
@@ -33,6 +43,14 @@ class SetupStates(StatesGroup):
     waiting_stories = State()
 
 
+async def _vk_client():
+    """Модуль vk_client; первый импорт идёт в потоке, чтобы не блокировать event loop для всех чатов."""
+    module = sys.modules.get("vk_client")
+    if module is None:
+        module = await asyncio.to_thread(importlib.import_module, "vk_client")
+    return module
+
+
 def _user_dir(user_id: int) -> Path:
     path = DOWNLOADS_DIR / str(user_id)
     path.mkdir(parents=True, exist_ok=True)
@@ -65,6 +83,28 @@ async def _download_video(bot: Bot, message: Message, user_id: int) -> Path | No
     return dest
 
 
+async def _collecting_media(state: FSMContext) -> bool:
+    """Пост всё ещё ждёт медиа (тяжёлый обработчик мог простоять в очереди, пока пользователь ушёл дальше)."""
+    return await state.get_state() == PublishStates.waiting_media.state
+
+
+def _discard_files(paths: list[Path]) -> None:
+    for p in paths:
+        try:
+            p.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+def _parse_tokens(text: str) -> list[str]:
+    """Разбивает сообщение с токенами (по одному на строку, через запятую или пробел) без повторов."""
+    tokens: list[str] = []
+    for part in text.replace(",", " ").split():
+        if part not in tokens:
+            tokens.append(part)
+    return tokens
+
+
 def _parse_group_ids(text: str) -> list[int] | None:
     """Парсит строку вида '-123, -456' или '123, 456' в список int (для групп — отрицательные)."""
     try:
@@ -113,6 +153,8 @@ async def cmd_setup(message: Message, state: FSMContext) -> None:
     await message.answer(
         "Настройка VK. Твои данные сохраняются только в облачной базе бота и привязаны к твоему Telegram.\n\n"
         "Отправь свой <b>VK Access Token</b> (один сообщением).\n"
+        "Можно отправить несколько токенов (например, свой и токены сообществ) — по одному на строку: "
+        "публикации будут распределяться между ними.\n"
         "Как получить: приложение ВК → права wall, photos, stories, offline, groups.",
         parse_mode="HTML",
     )
@@ -120,17 +162,22 @@ async def cmd_setup(message: Message, state: FSMContext) -> None:
 
 @router.message(SetupStates.waiting_token, F.text)
 async def setup_handle_token(message: Message, state: FSMContext) -> None:
-    token = (message.text or "").strip()
-    if not token:
+    validate_vk_token = (await _vk_client()).validate_vk_token
+    tokens = _parse_tokens(message.text or "")
+    if not tokens:
         await message.answer("Отправь токен текстом.")
         return
-    if not validate_vk_token(token):
-        await message.answer("Токен не прошёл проверку ВК. Проверь права и скопируй токен заново.")
+    results = await asyncio.gather(*(asyncio.to_thread(validate_vk_token, token) for token in tokens))
+    invalid = [str(idx) for idx, ok in enumerate(results, start=1) if not ok]
+    if invalid:
+        await message.answer(
+            f"Токен(ы) № {', '.join(invalid)} не прошли проверку ВК. Проверь права и отправь токены заново."
+        )
         return
-    await state.update_data(vk_access_token=token)
+    await state.update_data(vk_access_tokens=tokens)
     await state.set_state(SetupStates.waiting_groups)
     await message.answer(
-        "Токен принят. Теперь отправь <b>ID групп ВК</b> через запятую.\n"
+        f"Токенов принято: {len(tokens)}. Теперь отправь <b>ID групп ВК</b> через запятую.\n"
         "Например: <code>-123456789, -987654321</code> или <code>123456789, 987654321</code>.",
         parse_mode="HTML",
     )
@@ -164,11 +211,11 @@ async def setup_handle_stories(message: Message, state: FSMContext) -> None:
             await message.answer("Отправь одно число (ID группы для историй) или «Пропустить».")
             return
     data = await state.get_data()
-    token = data["vk_access_token"]
+    tokens = data["vk_access_tokens"]
     group_ids = data["vk_group_ids"]
     set_user_credentials(
         message.from_user.id,
-        vk_access_token=token,
+        vk_access_tokens=tokens,
         vk_group_ids=group_ids,
         vk_stories_group_id=stories_id,
     )
@@ -181,6 +228,7 @@ async def setup_handle_stories(message: Message, state: FSMContext) -> None:
 @router.message(Command("post"))
 async def cmd_post(message: Message, state: FSMContext) -> None:
     await state.clear()
+    reply_coalescer.reset(message.chat.id)
     await state.set_state(PublishStates.waiting_media)
     await message.answer(
         "Отправь фото или видео для поста. Можно несколько фото подряд. "
@@ -189,31 +237,47 @@ async def cmd_post(message: Message, state: FSMContext) -> None:
     )
 
 
-@router.message(PublishStates.waiting_media, F.photo)
+@router.message(PublishStates.waiting_media, F.photo, flags={"heavy": True})
 async def handle_photo(message: Message, state: FSMContext, bot: Bot) -> None:
+    if not await _collecting_media(state):
+        return
     paths = await _download_photo(bot, message, message.from_user.id)
+    if not await _collecting_media(state):
+        _discard_files(paths)
+        return
     data = await state.get_data()
     photos: list = data.get("photo_paths", [])
     photos.extend(paths)
     await state.update_data(photo_paths=[str(p) for p in photos])
-    await message.answer(f"Добавлено фото. Всего фото: {len(photos)}. Отправь ещё или текст поста.")
+    status = reply_coalescer.get(bot, message.chat.id, "photos")
+    await status.update(f"Добавлено фото. Всего фото: {len(photos)}. Отправь ещё или текст поста.")
 
-@router.message(PublishStates.waiting_media, F.video)
+@router.message(PublishStates.waiting_media, F.video, flags={"heavy": True})
 async def handle_video(message: Message, state: FSMContext, bot: Bot) -> None:
+    if not await _collecting_media(state):
+        return
     path = await _download_video(bot, message, message.from_user.id)
     if not path:
         await message.answer("Не удалось скачать видео.")
         return
+    if not await _collecting_media(state):
+        _discard_files([path])
+        return
     await state.update_data(video_path=str(path))
     await state.set_state(PublishStates.waiting_text)
     await message.answer("Видео получено. Теперь отправь текст поста (можно со ссылками) или «Пропустить».")
 
-@router.message(PublishStates.waiting_media, F.document)
+@router.message(PublishStates.waiting_media, F.document, flags={"heavy": True})
 async def handle_document(message: Message, state: FSMContext, bot: Bot) -> None:
+    if not await _collecting_media(state):
+        return
     # Документ может быть видео
     mime = (message.document.mime_type or "").lower()
     if "video" in mime:
         path = await _download_video(bot, message, message.from_user.id)
+        if path and not await _collecting_media(state):
+            _discard_files([path])
+            return
         if path:
             await state.update_data(video_path=str(path))
             await state.set_state(PublishStates.waiting_text)
@@ -223,6 +287,7 @@ async def handle_document(message: Message, state: FSMContext, bot: Bot) -> None
 
 @router.message(PublishStates.waiting_media, F.text)
 async def from_media_to_text(message: Message, state: FSMContext) -> None:
+    reply_coalescer.reset(message.chat.id)
     if message.text and message.text.strip().lower() in ("пропустить", "skip", "/skip"):
         await state.update_data(text="")
         await state.set_state(PublishStates.waiting_options)
@@ -271,6 +336,11 @@ async def _ask_options(message: Message) -> None:
     )
 
 
+@router.callback_query(F.data == "opt_publish", flags={"heavy": True})
+async def process_publish(callback: CallbackQuery, state: FSMContext) -> None:
+    await _do_publish(callback, state)
+
+
 @router.callback_query(F.data.startswith("opt_"))
 async def process_options(callback: CallbackQuery, state: FSMContext) -> None:
     data = await state.get_data()
@@ -290,9 +360,6 @@ async def process_options(callback: CallbackQuery, state: FSMContext) -> None:
         await state.update_data(add_audio=add_audio, publish_post=post, publish_story=story)
         await callback.message.edit_reply_markup(reply_markup=_keyboard_options())
         return
-    elif callback.data == "opt_publish":
-        await _do_publish(callback, state)
-        return
 
     await state.update_data(publish_post=post, publish_story=story)
     await callback.answer()
@@ -345,7 +412,7 @@ async def save_audio_comment(message: Message, state: FSMContext) -> None:
         await message.answer("Уточнение сохранено. Отправь /publish_now для публикации.")
 
 
-@router.message(Command("publish_now"))
+@router.message(Command("publish_now"), flags={"heavy": True})
 async def cmd_publish_now(message: Message, state: FSMContext) -> None:
     """Публикация после ввода уточнения по аудио."""
     data = await state.get_data()
@@ -376,13 +443,36 @@ async def _publish_and_reply(message: Message, request: PublishRequest, user_id:
             "Данные сохраняются в облаке и привязаны к твоему аккаунту."
         )
         return
+    global _first_publish_reported
+    VKPublisher = (await _vk_client()).VKPublisher
+
+    started = time.perf_counter()
+    status = StatusMessage(message.bot, message.chat.id)
+    loop = asyncio.get_running_loop()
+
+    def on_progress(text: str) -> None:
+        # Вызывается из рабочего потока публикации
+        loop.call_soon_threadsafe(status.schedule, text)
+
     try:
         publisher = VKPublisher(
-            access_token=creds["vk_access_token"],
+            access_tokens=creds["vk_access_tokens"],
             group_ids=creds["vk_group_ids"],
             stories_group_id=creds.get("vk_stories_group_id"),
         )
-        post_ids, story_ok = publisher.publish(request)
+        publish_task = asyncio.ensure_future(asyncio.to_thread(publisher.publish, request, on_progress))
+        # Быстрая публикация обходится одним ответом; статус с прогрессом — только для долгих
+        done, _ = await asyncio.wait({publish_task}, timeout=DEBOUNCE_INTERVAL)
+        if not done:
+            try:
+                await status.update("Публикация во ВК…")
+            except TelegramAPIError as e:
+                logger.warning("Не удалось отправить статус публикации: %s", e)
+        post_ids, story_ok = await publish_task
+        mark_user_active(user_id)
+        if not _first_publish_reported:
+            _first_publish_reported = True
+            logger.info("Первая публикация после запуска: %.2f с", time.perf_counter() - started)
         lines = []
         if post_ids:
             lines.append(f"Опубликовано постов: {len(post_ids)} (id: {post_ids})")
@@ -390,10 +480,10 @@ async def _publish_and_reply(message: Message, request: PublishRequest, user_id:
             lines.append("История: " + ("опубликована" if story_ok else "ошибка публикации"))
         if request.add_audio:
             lines.append("Музыка/аудио: учтено (уточнение: " + (request.audio_comment or "—") + "). Во ВК добавление трека в пост делается вручную или через отдельный метод API.")
-        await message.answer("\n".join(lines) if lines else "Готово.")
+        await status.finish("\n".join(lines) if lines else "Готово.")
     except Exception as e:
         logger.exception("Publish error")
-        await message.answer(f"Ошибка публикации: {e}")
+        await status.finish(f"Ошибка публикации: {e}")
     finally:
         # Очистка скачанных файлов
         for p in request.photo_paths:
@@ -1,14 +1,31 @@
 """Точка входа: запуск Telegram-бота для публикации во ВК."""
-import asyncio
-import logging
-import sys
+import time
 
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
+# Первой инструкцией: время запуска включает импорт модулей
+_STARTED_AT = time.perf_counter()
 
-from config import TELEGRAM_BOT_TOKEN
-from handlers import router
-from storage import init_db
+import asyncio  # noqa: E402
+import logging  # noqa: E402
+import sys  # noqa: E402
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+
+from config import (  # noqa: E402
+    HEAVY_MAX_CONCURRENCY,
+    HEAVY_MAX_QUEUE_PER_USER,
+    HEAVY_MAX_QUEUE_TOTAL,
+    PREWARM_ENABLED,
+    PREWARM_RECENT_USERS,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_PER_SECOND,
+    TELEGRAM_BOT_TOKEN,
+)
+from handlers import router  # noqa: E402
+from middlewares import AdmissionMiddleware, FairScheduler, ThrottlingMiddleware  # noqa: E402
+from storage import get_recent_access_tokens, init_db  # noqa: E402
+
+_IMPORTED_AT = time.perf_counter()
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,6 +34,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _prewarm() -> None:
+    """Прогрев в фоне: клиент VK и HTTP-сессии недавно активных пользователей (соединение с БД открывает init_db)."""
+    started = time.perf_counter()
+    try:
+        tokens = get_recent_access_tokens(PREWARM_RECENT_USERS)
+
+        def warm_vk() -> int:
+            # Первый импорт vk_api/requests тоже происходит здесь, а не при запуске
+            import vk_client
+
+            return vk_client.prewarm_sessions(tokens)
+
+        warmed = await asyncio.to_thread(warm_vk)
+        logger.info("Прогрев завершён за %.2f с (VK-сессий: %s)", time.perf_counter() - started, warmed)
+    except Exception:
+        logger.exception("Ошибка прогрева")
+
+
+async def on_startup() -> None:
+    logger.info(
+        "Бот запущен за %.2f с (импорт модулей %.2f с, инициализация %.2f с)",
+        time.perf_counter() - _STARTED_AT,
+        _IMPORTED_AT - _STARTED_AT,
+        time.perf_counter() - _IMPORTED_AT,
+    )
+    if PREWARM_ENABLED:
+        task = asyncio.create_task(_prewarm())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
 
 async def main() -> None:
     if not TELEGRAM_BOT_TOKEN:
@@ -27,10 +77,24 @@ async def main() -> None:
 
     bot = Bot(token=TELEGRAM_BOT_TOKEN, parse_mode=ParseMode.HTML)
     dp = Dispatcher()
+
+    # Лимит частоты на пользователя и общий лимит тяжёлых операций со справедливой очередью
+    throttling = ThrottlingMiddleware(rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST)
+    admission = AdmissionMiddleware(
+        FairScheduler(
+            max_concurrency=HEAVY_MAX_CONCURRENCY,
+            max_queue_per_user=HEAVY_MAX_QUEUE_PER_USER,
+            max_queue_total=HEAVY_MAX_QUEUE_TOTAL,
+        )
+    )
+    for observer in (dp.message, dp.callback_query):
+        observer.outer_middleware(throttling)
+        observer.middleware(admission)
+
     dp.include_router(router)
+    dp.startup.register(on_startup)
 
     try:
-        logger.info("Бот запущен")
         await dp.start_polling(bot)
     finally:
         await bot.session.close()
@@ -0,0 +1,190 @@
+"""Middleware диспетчера: ограничение частоты запросов и справедливая очередь тяжёлых операций."""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]]
+
+THROTTLED_TEXT = "Слишком много запросов. Подожди несколько секунд и повтори."
+OVERLOADED_TEXT = "Бот сейчас перегружен. Попробуй ещё раз через минуту."
+
+
+async def _reply(event: TelegramObject, text: str) -> None:
+    if isinstance(event, CallbackQuery):
+        await event.answer(text, show_alert=True)
+    elif isinstance(event, Message):
+        await event.answer(text)
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не более capacity."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self.warned = False  # пользователь уже получил предупреждение о лимите
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def consume(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self._capacity
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware: у каждого пользователя своя корзина токенов.
+    Превысившим лимит отвечаем один раз, остальные апдейты молча отбрасываем.
+    """
+
+    _PRUNE_THRESHOLD = 10_000
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._buckets: dict[int, TokenBucket] = {}
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        bucket = self._buckets.get(user.id)
+        if bucket is None:
+            if len(self._buckets) >= self._PRUNE_THRESHOLD:
+                self._prune()
+            bucket = self._buckets[user.id] = TokenBucket(self._rate, self._burst)
+        if not bucket.consume():
+            if not bucket.warned:
+                bucket.warned = True
+                logger.info("Rate limit for telegram_user_id=%s", user.id)
+                await _reply(event, THROTTLED_TEXT)
+            elif isinstance(event, CallbackQuery):
+                # Без ответа у кнопки крутится индикатор загрузки до таймаута клиента
+                await event.answer()
+            return None
+        bucket.warned = False
+        return await handler(event, data)
+
+    def _prune(self) -> None:
+        """Удаляет корзины давно неактивных пользователей (полные корзины)."""
+        for user_id in [uid for uid, b in self._buckets.items() if b.is_full()]:
+            del self._buckets[user_id]
+
+
+class Overloaded(Exception):
+    """Очередь тяжёлых операций переполнена."""
+
+
+class FairScheduler:
+    """
+    Глобальный лимит одновременных тяжёлых операций (скачивания, публикации)
+    с очередью по пользователям: свободный слот получает следующий пользователь по кругу,
+    поэтому один активный пользователь не вытесняет остальных.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue_per_user: int, max_queue_total: int) -> None:
+        self._free = max_concurrency
+        self._max_queue_per_user = max_queue_per_user
+        self._max_queue_total = max_queue_total
+        # Порядок ключей dict — порядок обхода по кругу
+        self._queues: dict[int, deque[asyncio.Future]] = {}
+        self._waiting = 0
+
+    async def acquire(self, user_id: int) -> None:
+        """Ждёт свободный слот. Бросает Overloaded, если очередь переполнена."""
+        if self._free > 0 and not self._waiting:
+            self._free -= 1
+            return
+        queue = self._queues.get(user_id)
+        if self._waiting >= self._max_queue_total or (queue and len(queue) >= self._max_queue_per_user):
+            raise Overloaded
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(future)
+        self._waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но задача отменена — возвращаем его
+                self.release()
+            else:
+                self._discard(user_id, future)
+            raise
+
+    def release(self) -> None:
+        self._free += 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._free > 0 and self._queues:
+            user_id = next(iter(self._queues))
+            queue = self._queues.pop(user_id)
+            future = queue.popleft()
+            if queue:
+                self._queues[user_id] = queue  # в конец круга
+            self._waiting -= 1
+            if future.cancelled():
+                continue
+            self._free -= 1
+            future.set_result(None)
+
+    def _discard(self, user_id: int, future: asyncio.Future) -> None:
+        queue = self._queues.get(user_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[user_id]
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware: обработчики с флагом heavy выполняются только
+    в слоте FairScheduler. При переполнении очереди пользователь получает отказ
+    один раз, пока ему снова не достанется слот.
+    """
+
+    def __init__(self, scheduler: FairScheduler) -> None:
+        self._scheduler = scheduler
+        self._warned: set[int] = set()  # пользователи, уже получившие отказ
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if not get_flag(data, "heavy") or user is None:
+            return await handler(event, data)
+        try:
+            await self._scheduler.acquire(user.id)
+        except Overloaded:
+            if user.id not in self._warned:
+                self._warned.add(user.id)
+                logger.warning("Heavy queue overloaded, rejecting telegram_user_id=%s", user.id)
+                await _reply(event, OVERLOADED_TEXT)
+            elif isinstance(event, CallbackQuery):
+                await event.answer()
+            return None
+        self._warned.discard(user.id)
+        try:
+            return await handler(event, data)
+        finally:
+            self._scheduler.release()
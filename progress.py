@@ -0,0 +1,155 @@
+"""Статусные сообщения: одно сообщение на альбом/серию, обновляемое через edit_message_text."""
+import asyncio
+import logging
+import time
+from typing import Hashable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE_INTERVAL = 1.5  # секунд между правками одного сообщения
+BURST_WINDOW = 10.0  # секунд тишины, после которых серия считается завершённой
+
+
+class StatusMessage:
+    """
+    Одно статусное сообщение в чате.
+    Первый текст отправляется сразу, последующие копятся и применяются
+    правкой сообщения не чаще раза в interval секунд (применяется только последний).
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, interval: float = DEBOUNCE_INTERVAL) -> None:
+        self._bot = bot
+        self._chat_id = chat_id
+        self._interval = interval
+        self._message_id: Optional[int] = None
+        self._shown: Optional[str] = None  # текст, который сейчас видит пользователь
+        self._pending: Optional[str] = None  # последний запрошенный текст
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.last_update = time.monotonic()
+
+    async def update(self, text: str) -> None:
+        """Показывает текст: первое обновление — новым сообщением, остальные — отложенной правкой."""
+        self._pending = text
+        self.last_update = time.monotonic()
+        async with self._lock:
+            if self._message_id is None:
+                sent = await self._bot.send_message(self._chat_id, text)
+                self._message_id = sent.message_id
+                self._shown = text
+                if self._pending == self._shown:
+                    return
+                # Пока отправлялось первое сообщение, пришёл более новый текст
+        self._schedule_flush(self._interval)
+
+    def schedule(self, text: str) -> None:
+        """Синхронный вариант update для колбэков: только откладывает правку (вызывать из потока event loop)."""
+        self._pending = text
+        self.last_update = time.monotonic()
+        if self._message_id is not None:
+            self._schedule_flush(self._interval)
+
+    async def finish(self, text: str) -> None:
+        """
+        Немедленно показывает итоговый текст, отменяя отложенную правку.
+        Если статус ещё не отправлялся — итог уходит одним сообщением.
+        При flood limit ждёт и повторяет; если правка невозможна (например, сообщение удалено),
+        текст отправляется новым сообщением.
+        """
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._pending = text
+        self.last_update = time.monotonic()
+        async with self._lock:
+            while True:
+                try:
+                    if self._message_id is not None:
+                        if text == self._shown:
+                            return
+                        try:
+                            await self._bot.edit_message_text(
+                                text,
+                                chat_id=self._chat_id,
+                                message_id=self._message_id,
+                            )
+                            self._shown = text
+                            return
+                        except TelegramBadRequest as e:
+                            logger.warning("Не удалось обновить статус, отправляю новым сообщением: %s", e)
+                            self._message_id = None
+                    sent = await self._bot.send_message(self._chat_id, text)
+                    self._message_id = sent.message_id
+                    self._shown = text
+                    return
+                except TelegramRetryAfter as e:
+                    logger.warning("Flood limit при итоговом статусе, повтор через %s с", e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+
+    def _schedule_flush(self, delay: float) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: Optional[float]) -> None:
+        while delay is not None:
+            await asyncio.sleep(delay)
+            delay = await self._flush()
+
+    async def _flush(self) -> Optional[float]:
+        """Применяет последний текст. Возвращает задержку до следующей правки или None, если всё показано."""
+        async with self._lock:
+            text = self._pending
+            if self._message_id is None or text is None or text == self._shown:
+                return None
+            try:
+                await self._bot.edit_message_text(
+                    text,
+                    chat_id=self._chat_id,
+                    message_id=self._message_id,
+                )
+                self._shown = text
+            except TelegramRetryAfter as e:
+                logger.warning("Flood limit при правке статуса, повтор через %s с", e.retry_after)
+                return e.retry_after
+            except TelegramBadRequest as e:
+                # Например, сообщение удалено пользователем
+                logger.warning("Не удалось обновить статус: %s", e)
+                return None
+            # Пока шла правка, мог прийти более новый текст
+            return self._interval if self._pending != self._shown else None
+
+
+class ReplyCoalescer:
+    """Реестр статусных сообщений по ключу (чат + серия), чтобы не слать по сообщению на каждое событие."""
+
+    def __init__(
+        self,
+        interval: float = DEBOUNCE_INTERVAL,
+        burst_window: float = BURST_WINDOW,
+    ) -> None:
+        self._interval = interval
+        self._burst_window = burst_window
+        self._statuses: dict[tuple[int, Hashable], StatusMessage] = {}
+
+    def get(self, bot: Bot, chat_id: int, key: Hashable) -> StatusMessage:
+        """Возвращает статус текущей серии или начинает новую, если прошлая затихла."""
+        self._prune()
+        status = self._statuses.get((chat_id, key))
+        if status is None:
+            status = StatusMessage(bot, chat_id, self._interval)
+            self._statuses[(chat_id, key)] = status
+        return status
+
+    def reset(self, chat_id: int) -> None:
+        """Завершает все серии чата: следующий статус придёт новым сообщением."""
+        self._prune()
+        for key in [k for k in self._statuses if k[0] == chat_id]:
+            del self._statuses[key]
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        stale = [k for k, s in self._statuses.items() if now - s.last_update > self._burst_window]
+        for key in stale:
+            del self._statuses[key]
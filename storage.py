@@ -15,30 +15,45 @@ def _ensure_db_dir() -> None:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
 
+_conn: Optional[sqlite3.Connection] = None
+
+
+def _connect() -> sqlite3.Connection:
+    """Общее соединение с БД: открывается один раз и используется из потока event loop."""
+    global _conn
+    if _conn is None:
+        _ensure_db_dir()
+        _conn = sqlite3.connect(DB_PATH)
+        _conn.row_factory = sqlite3.Row
+    return _conn
+
+
 def init_db() -> None:
     """Создаёт таблицу учётных данных, если её нет."""
-    _ensure_db_dir()
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS user_credentials (
                 telegram_user_id INTEGER PRIMARY KEY,
-                vk_access_token TEXT NOT NULL,
+                vk_access_token TEXT NOT NULL,  -- один или несколько токенов через запятую
                 vk_group_ids TEXT NOT NULL,
                 vk_stories_group_id TEXT,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                last_active_at TEXT
             )
             """
         )
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(user_credentials)")}
+        if "last_active_at" not in columns:
+            conn.execute("ALTER TABLE user_credentials ADD COLUMN last_active_at TEXT")
 
 
 def get_user_credentials(telegram_user_id: int) -> Optional[dict]:
     """
     Возвращает сохранённые VK-данные пользователя или None.
-    dict: vk_access_token, vk_group_ids (list[int]), vk_stories_group_id (int | None).
+    dict: vk_access_tokens (list[str]), vk_group_ids (list[int]), vk_stories_group_id (int | None).
     """
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
+    with _connect() as conn:
         row = conn.execute(
             "SELECT vk_access_token, vk_group_ids, vk_stories_group_id FROM user_credentials WHERE telegram_user_id = ?",
             (telegram_user_id,),
@@ -49,8 +64,10 @@ def get_user_credentials(telegram_user_id: int) -> Optional[dict]:
     group_ids = [int(gid.strip()) for gid in group_ids_str.split(",") if gid.strip()]
     stories_id = row["vk_stories_group_id"]
     stories_group_id = int(stories_id) if stories_id else (group_ids[0] if group_ids else None)
+    tokens_str = row["vk_access_token"] or ""
+    tokens = [token.strip() for token in tokens_str.split(",") if token.strip()]
     return {
-        "vk_access_token": row["vk_access_token"],
+        "vk_access_tokens": tokens,
         "vk_group_ids": group_ids,
         "vk_stories_group_id": stories_group_id,
     }
@@ -58,15 +75,15 @@ def get_user_credentials(telegram_user_id: int) -> Optional[dict]:
 
 def set_user_credentials(
     telegram_user_id: int,
-    vk_access_token: str,
+    vk_access_tokens: list[str],
     vk_group_ids: list[int],
     vk_stories_group_id: Optional[int] = None,
 ) -> None:
     """Сохраняет или обновляет VK-учётные данные пользователя."""
-    _ensure_db_dir()
+    tokens_str = ",".join(token.strip() for token in vk_access_tokens)
     group_ids_str = ",".join(str(gid) for gid in vk_group_ids)
     stories_str = str(vk_stories_group_id) if vk_stories_group_id is not None else None
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         conn.execute(
             """
             INSERT INTO user_credentials (telegram_user_id, vk_access_token, vk_group_ids, vk_stories_group_id, updated_at)
@@ -77,6 +94,33 @@ def set_user_credentials(
                 vk_stories_group_id = excluded.vk_stories_group_id,
                 updated_at = CURRENT_TIMESTAMP
             """,
-            (telegram_user_id, vk_access_token.strip(), group_ids_str, stories_str),
+            (telegram_user_id, tokens_str, group_ids_str, stories_str),
         )
     logger.info("Credentials saved for telegram_user_id=%s", telegram_user_id)
+
+
+def mark_user_active(telegram_user_id: int) -> None:
+    """Отмечает время последней публикации пользователя (для прогрева при следующем запуске)."""
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE user_credentials SET last_active_at = CURRENT_TIMESTAMP WHERE telegram_user_id = ?",
+            (telegram_user_id,),
+        )
+
+
+def get_recent_access_tokens(limit: int) -> list[str]:
+    """VK-токены пользователей, публиковавших последними (не более limit пользователей)."""
+    with _connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT vk_access_token FROM user_credentials
+            WHERE last_active_at IS NOT NULL
+            ORDER BY last_active_at DESC
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+    tokens: list[str] = []
+    for row in rows:
+        tokens.extend(token.strip() for token in (row["vk_access_token"] or "").split(",") if token.strip())
+    return tokens
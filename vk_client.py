@@ -1,15 +1,43 @@
 """Клиент VK API: посты на стену и истории."""
 import logging
-from typing import Optional
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional, TypeVar
 
+import requests
 import vk_api
 from vk_api import VkUpload
-from vk_api.exceptions import VkApiError
+from vk_api.exceptions import ApiError, VkApiError
 
 from models import PublishRequest
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Лимит VK API для пользовательского токена — 3 запроса в секунду (у токена сообщества больше)
+VK_REQUESTS_PER_SECOND = 3
+
+# Коды ошибок VK API, после которых токен временно отстраняется (секунды)
+_BENCH_SECONDS = {
+    5: float("inf"),  # авторизация не удалась: токен отозван или истёк
+    6: 1.0,  # слишком много запросов в секунду
+    9: 60.0,  # flood control: слишком много однотипных действий
+    29: 600.0,  # достигнут количественный лимит на вызов метода
+}
+
+# Ошибки доступа: у этого токена нет прав на группу/действие, другой токен может подойти
+_ACCESS_ERROR_CODES = {15, 214}
+
+
+VK_API_URL = "https://api.vk.com/"
+
+# Сколько токенов держать в реестре; сессии давно не использованных закрываются
+MAX_CACHED_TOKENS = 256
+
 
 def validate_vk_token(access_token: str) -> bool:
     """Проверяет, что токен VK действителен (лёгкий запрос users.get)."""
@@ -21,18 +49,214 @@ def validate_vk_token(access_token: str) -> bool:
         return False
 
 
+class _TokenState:
+    """
+    Состояние VK-токена, общее для всех публикаций процесса:
+    занятость, учёт запросов за последнюю секунду и отстранение при ошибках.
+    """
+
+    def __init__(self) -> None:
+        self.session: Optional[vk_api.VkApi] = None
+        self.refs = 0  # сколько живых пулов публикации держат этот токен
+        self.busy = False
+        self.benched_until = 0.0
+        self._calls: deque[float] = deque()
+
+    def close_session(self) -> None:
+        if self.session is not None:
+            self.session.http.close()
+            self.session = None
+
+    def remaining_budget(self, now: float) -> int:
+        while self._calls and now - self._calls[0] >= 1.0:
+            self._calls.popleft()
+        return VK_REQUESTS_PER_SECOND - len(self._calls)
+
+    def spend(self, cost: int) -> None:
+        """Учитывает cost запросов, при исчерпании бюджета ждёт освобождения окна."""
+        now = time.monotonic()
+        if self.remaining_budget(now) < cost and self._calls:
+            time.sleep(max(0.0, 1.0 - (now - self._calls[0])))
+            now = time.monotonic()
+            self.remaining_budget(now)
+        self._calls.extend([now] * cost)
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.benched_until
+
+    def is_revoked(self) -> bool:
+        return self.benched_until == float("inf")
+
+
+# Реестр токенов процесса в порядке LRU: сессия VK живёт между публикациями
+# (пул HTTP-соединений, DNS, TLS переиспользуются), там же бюджет и отстранение.
+# _tokens_cond защищает реестр, сессии и флаги busy.
+_token_states: OrderedDict[str, _TokenState] = OrderedDict()
+_tokens_cond = threading.Condition()
+
+
+def _get_token_state(access_token: str) -> _TokenState:
+    with _tokens_cond:
+        state = _token_states.get(access_token)
+        if state is None:
+            state = _token_states[access_token] = _TokenState()
+            _evict_tokens(keep=access_token)
+        else:
+            _token_states.move_to_end(access_token)
+        return state
+
+
+def _evict_tokens(keep: str) -> None:
+    """
+    Убирает из реестра самые давние токены сверх MAX_CACHED_TOKENS (под _tokens_cond).
+    Не трогает только что добавленный токен keep и токены, которые используются пулами
+    или отстранены: иначе потерялись бы общий бюджет и отметка об отстранении.
+    """
+    excess = len(_token_states) - MAX_CACHED_TOKENS
+    now = time.monotonic()
+    for token in list(_token_states):
+        if excess <= 0:
+            break
+        state = _token_states[token]
+        if token == keep or state.busy or state.refs or not state.is_healthy(now):
+            continue
+        del _token_states[token]
+        state.close_session()
+        excess -= 1
+
+
+def _get_session(access_token: str) -> Optional[vk_api.VkApi]:
+    """Сессия токена из реестра; None, если токен отозван (ошибка 5)."""
+    state = _get_token_state(access_token)
+    with _tokens_cond:
+        if state.is_revoked():
+            return None
+        if state.session is None:
+            state.session = vk_api.VkApi(token=access_token)
+        return state.session
+
+
+def _unref_states(states: list[_TokenState]) -> None:
+    with _tokens_cond:
+        for state in states:
+            state.refs -= 1
+
+
+def prewarm_sessions(access_tokens: list[str]) -> int:
+    """
+    Создаёт сессии для токенов и открывает HTTPS-соединение с api.vk.com,
+    чтобы первая публикация не ждала DNS и TLS. Возвращает число прогретых сессий.
+    """
+    warmed = 0
+    for token in dict.fromkeys(access_tokens):
+        session = _get_session(token)
+        if session is None:
+            continue
+        try:
+            session.http.head(VK_API_URL, timeout=5)
+            warmed += 1
+        except requests.RequestException as e:
+            logger.warning("VK session pre-warm failed: %s", e)
+    return warmed
+
+
+class _TokenSlot:
+    """Токен в пуле публикации: сессия VK и ссылка на общее состояние токена."""
+
+    def __init__(self, access_token: str) -> None:
+        self.state = _get_token_state(access_token)
+        # У отозванного токена сессии нет; пул его не выбирает, так как он отстранён навсегда
+        self.session = _get_session(access_token)
+        self.api = self.session.get_api() if self.session else None
+        self.upload = VkUpload(self.session) if self.session else None
+
+
+class _TokenPool:
+    """
+    Набор VK-токенов пользователя. Каждый вызов получает свободный здоровый токен
+    с наибольшим остатком бюджета запросов; токен с ошибкой авторизации или флуда отстраняется.
+    """
+
+    def __init__(self, access_tokens: list[str]) -> None:
+        with _tokens_cond:
+            self._slots = [_TokenSlot(token) for token in dict.fromkeys(access_tokens)]
+            states = [slot.state for slot in self._slots]
+            for state in states:
+                state.refs += 1
+        # Пока пул жив, его токены не вытесняются из реестра
+        weakref.finalize(self, _unref_states, states)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _acquire(self, exclude: set[int]) -> Optional[_TokenSlot]:
+        with _tokens_cond:
+            while True:
+                now = time.monotonic()
+                candidates = [
+                    slot for idx, slot in enumerate(self._slots)
+                    if idx not in exclude and slot.state.is_healthy(now)
+                ]
+                if not candidates:
+                    return None
+                free = [slot for slot in candidates if not slot.state.busy]
+                if free:
+                    slot = max(free, key=lambda s: s.state.remaining_budget(now))
+                    slot.state.busy = True
+                    return slot
+                _tokens_cond.wait()
+
+    def _release(self, slot: _TokenSlot) -> None:
+        with _tokens_cond:
+            slot.state.busy = False
+            _tokens_cond.notify_all()
+
+    def call(self, func: Callable[[_TokenSlot], T], cost: int = 1) -> T:
+        """
+        Выполняет func(slot) на лучшем доступном токене.
+        При ошибке авторизации, флуда или доступа (например, токен сообщества
+        без прав на другую группу) пробует следующий токен; если не подошёл ни один —
+        бросает последнюю ошибку. Остальные ошибки VK API пробрасываются сразу.
+        """
+        tried: set[int] = set()
+        last_error: Optional[VkApiError] = None
+        while True:
+            slot = self._acquire(tried)
+            if slot is None:
+                raise last_error or VkApiError("Нет доступных VK-токенов")
+            idx = self._slots.index(slot)
+            tried.add(idx)
+            try:
+                slot.state.spend(cost)
+                return func(slot)
+            except ApiError as e:
+                if e.code not in _BENCH_SECONDS and e.code not in _ACCESS_ERROR_CODES:
+                    raise
+                last_error = e
+                bench = _BENCH_SECONDS.get(e.code)
+                if bench:
+                    slot.state.benched_until = time.monotonic() + bench
+                    logger.warning("VK token #%s benched for %ss after error %s", idx, bench, e.code)
+                    if e.code == 5:
+                        # Токен отозван: его сессия больше не понадобится, отметка об отстранении остаётся
+                        with _tokens_cond:
+                            slot.state.close_session()
+                else:
+                    logger.warning("VK token #%s has no access (error %s), trying next token", idx, e.code)
+            finally:
+                self._release(slot)
+
+
 class VKPublisher:
     """Публикация постов и историй во ВКонтакте."""
 
     def __init__(
         self,
-        access_token: str,
+        access_tokens: list[str],
         group_ids: list[int],
         stories_group_id: Optional[int] = None,
     ) -> None:
-        self._session = vk_api.VkApi(token=access_token)
-        self._api = self._session.get_api()
-        self._upload = VkUpload(self._session)
+        self._pool = _TokenPool(access_tokens)
         self._group_ids = group_ids
         self._stories_group_id = stories_group_id or (group_ids[0] if group_ids else None)
 
@@ -43,37 +267,41 @@ class VKPublisher:
         Возвращает post_id или None при ошибке.
         """
         owner_id = group_id  # уже отрицательный для группы
-        attachments: list[str] = []
+
+        # Видео: во ВК для стены обычно нужна ссылка на уже загруженное видео
+        # или загрузка через video.save — упрощённо не реализуем здесь,
+        # можно расширить через video.getUploadServer
+        if request.video_path:
+            logger.warning("Загрузка видео на стену пока не реализована")
 
         try:
-            # Загрузка фото
-            if request.photo_paths:
-                photo_list = [str(p) for p in request.photo_paths]
-                photo_attachments = self._upload.photo_wall(
-                    photo_list,
-                    group_id=abs(owner_id),
-                )
-                for photo in photo_attachments:
-                    attachments.append(
-                        f"photo{photo['owner_id']}_{photo['id']}"
-                    )
-
-            # Видео: во ВК для стены обычно нужна ссылка на уже загруженное видео
-            # или загрузка через video.save — упрощённо не реализуем здесь,
-            # можно расширить через video.getUploadServer
-            if request.video_path:
-                logger.warning("Загрузка видео на стену пока не реализована")
-
-            return self._api.wall.post(
-                owner_id=owner_id,
-                message=request.text or None,
-                attachments=",".join(attachments) if attachments else None,
-                from_group=1,
-            ).get("post_id")
+            # Загруженные фото прикрепляет тот же аккаунт, поэтому загрузка и пост идут через один токен
+            return self._pool.call(
+                lambda slot: self._post_to_wall(slot, request, owner_id),
+                cost=3 if request.photo_paths else 1,  # getWallUploadServer + saveWallPhoto + wall.post
+            )
         except VkApiError as e:
             logger.exception("VK wall.post error: %s", e)
             return None
 
+    @staticmethod
+    def _post_to_wall(slot: _TokenSlot, request: PublishRequest, owner_id: int) -> Optional[int]:
+        attachments: list[str] = []
+        if request.photo_paths:
+            photo_list = [str(p) for p in request.photo_paths]
+            photo_attachments = slot.upload.photo_wall(photo_list, group_id=abs(owner_id))
+            for photo in photo_attachments:
+                attachments.append(
+                    f"photo{photo['owner_id']}_{photo['id']}"
+                )
+
+        return slot.api.wall.post(
+            owner_id=owner_id,
+            message=request.text or None,
+            attachments=",".join(attachments) if attachments else None,
+            from_group=1,
+        ).get("post_id")
+
     def publish_story(
         self,
         request: PublishRequest,
@@ -98,58 +326,82 @@ class VKPublisher:
             return False
 
         try:
-            # stories.getPhotoUploadServer(owner_id=-group_id)
-            upload_url = self._api.stories.getPhotoUploadServer(
-                add_to_news=1,
-                user_id=0,
-                reply_to_story=None,
-                link_text=None,
-                link_url=None,
-                group_id=abs(gid),
-            ).get("upload_url")
-
-            if not upload_url:
-                logger.error("Не получен upload_url для истории")
-                return False
-
-            with open(file_path, "rb") as f:
-                files = {"file": f}
-                response = self._session.http.post(upload_url, files=files)
-
-            if response.status_code != 200:
-                logger.error("Ошибка загрузки файла истории: %s", response.text)
-                return False
-
-            result = response.json()
-            if "response" not in result:
-                logger.error("Некорректный ответ stories upload: %s", result)
-                return False
-
-            save_response = self._api.stories.save(
-                upload_results=result["response"],
-                extended=0,
-                fields=None,
+            # Сервер загрузки привязан к токену, поэтому вся цепочка идёт через один токен
+            return self._pool.call(
+                lambda slot: self._upload_story(slot, file_path, gid),
+                cost=2,  # getPhotoUploadServer + stories.save
             )
-            if not save_response.get("items"):
-                logger.error("stories.save не вернул items: %s", save_response)
-                return False
-            return True
         except (VkApiError, OSError) as e:
             logger.exception("VK story publish error: %s", e)
             return False
 
-    def publish(self, request: PublishRequest) -> tuple[list[int], bool]:
+    @staticmethod
+    def _upload_story(slot: _TokenSlot, file_path: str, gid: int) -> bool:
+        # stories.getPhotoUploadServer(owner_id=-group_id)
+        upload_url = slot.api.stories.getPhotoUploadServer(
+            add_to_news=1,
+            user_id=0,
+            reply_to_story=None,
+            link_text=None,
+            link_url=None,
+            group_id=abs(gid),
+        ).get("upload_url")
+
+        if not upload_url:
+            logger.error("Не получен upload_url для истории")
+            return False
+
+        with open(file_path, "rb") as f:
+            files = {"file": f}
+            response = slot.session.http.post(upload_url, files=files)
+
+        if response.status_code != 200:
+            logger.error("Ошибка загрузки файла истории: %s", response.text)
+            return False
+
+        result = response.json()
+        if "response" not in result:
+            logger.error("Некорректный ответ stories upload: %s", result)
+            return False
+
+        save_response = slot.api.stories.save(
+            upload_results=result["response"],
+            extended=0,
+            fields=None,
+        )
+        if not save_response.get("items"):
+            logger.error("stories.save не вернул items: %s", save_response)
+            return False
+        return True
+
+    def publish(
+        self,
+        request: PublishRequest,
+        on_progress: Optional[Callable[[str], None]] = None,
+    ) -> tuple[list[int], bool]:
         """
         Публикует пост во все настроенные группы и при необходимости историю.
+        on_progress — необязательный колбэк с текстом текущего шага.
         Возвращает (список post_id по группам, успех истории).
         """
         post_ids: list[int] = []
-        for gid in self._group_ids:
-            if request.publish_post:
-                pid = self.publish_post(request, gid)
+        if request.publish_post and self._group_ids:
+            total = len(self._group_ids)
+            if on_progress:
+                on_progress(f"Публикация поста: 0 из {total} групп…")
+            # Группы публикуются параллельно, по одному потоку на токен
+            with ThreadPoolExecutor(max_workers=min(len(self._pool), total)) as executor:
+                futures = [executor.submit(self.publish_post, request, gid) for gid in self._group_ids]
+                for done, _ in enumerate(as_completed(futures), start=1):
+                    if on_progress:
+                        on_progress(f"Публикация поста: {done} из {total} групп…")
+            for future in futures:
+                pid = future.result()
                 if pid is not None:
                     post_ids.append(pid)
         story_ok = False
         if request.publish_story and (request.photo_paths or request.video_path):
+            if on_progress:
+                on_progress("Публикация истории…")
             story_ok = self.publish_story(request)
         return post_ids, story_ok